@@ -1,29 +1,45 @@
-import os
+import sys
 from time import time
 
 from smolagents import CodeAgent, ToolCallingAgent
-from smolagents.models import LiteLLMModel
+from smolagents.models import ChatMessageStreamDelta
 
-from uwazi_agents.use_cases.uwazi_agent_interface import get_all_templates, get_all_entities, create_template
+from uwazi_agents.model_router import pick_model
+from uwazi_agents.use_cases.uwazi_agent_interface import (
+    get_all_templates,
+    get_all_entities,
+    create_template,
+    create_templates_bulk,
+)
 
 
 def run_uwazi_agent(prompt):
-    # model = LiteLLMModel(model_id="ollama/qwen2.5-coder:14b", api_base="http://localhost:11434", temperature=0.2)
-    # model = LiteLLMModel(model_id="ollama/gemma3:12b", api_base="http://localhost:11434")
-    # model = LiteLLMModel(model_id="gemini/gemini-2.5-flash", api_key=os.getenv("GOOGLE_API_KEY"))
-    model = LiteLLMModel(model_id="gemini/gemini-2.5-pro", api_key=os.getenv("GOOGLE_API_KEY"))
+    # smolagents already stops generation at "Observation:"; the cap bounds a runaway step. It is generous
+    # because Gemini 2.5 counts thinking tokens against it.
+    model = pick_model(prompt, max_tokens=4096)
     # agent = ToolCallingAgent(
     #     tools=[get_all_templates, get_all_entities, create_template],
     #     model=model
     # )
     agent = CodeAgent(
-        tools=[create_template],
+        tools=[create_template, create_templates_bulk],
         model=model,
-        additional_authorized_imports=["xml.*", "uwazi_agents.domain.Template", "uwazi_agents.domain.TemplateProperty"],
+        instructions="When more than one template has to be created, create all of them with a single "
+        "create_templates_bulk call instead of calling create_template once per template.",
         use_structured_outputs_internally=True,
+        stream_outputs=True,
     )
 
-    agent.run(prompt)
+    start = time()
+    first_token_at = None
+    for event in agent.run(prompt, stream=True):
+        if isinstance(event, ChatMessageStreamDelta) and event.content:
+            if first_token_at is None:
+                first_token_at = time()
+            sys.stdout.write(event.content)
+            sys.stdout.flush()
+    if first_token_at is not None:
+        print("\nTTFT", round(first_token_at - start, 2), "s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+"""Response cache for smolagents' ``LiteLLMModel``.
+
+Agent scripts get re-run with the same prompts over and over while
+iterating, and every agent step is a full round trip to Gemini/Ollama.
+``CachedLiteLLMModel`` keys each request by a hash of its canonical
+JSON form and replays the stored reply from a local SQLite file instead
+of calling the provider again. Re-running a script with an unchanged
+prompt therefore makes no LLM calls at all: the agent replays the same
+code, and only the tool calls it contains are executed again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections.abc import Generator
+from pathlib import Path
+from typing import Any
+
+from smolagents.models import (
+    ChatMessage,
+    ChatMessageStreamDelta,
+    ChatMessageToolCallStreamDelta,
+    LiteLLMModel,
+    agglomerate_stream_deltas,
+)
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "uwazi_agents" / "llm_cache.sqlite"
+
+
+def _message_to_dict(message: ChatMessage | dict) -> dict[str, Any]:
+    if isinstance(message, ChatMessage):
+        # model_dump_json drops ``raw``, which holds the provider response object.
+        return json.loads(message.model_dump_json())
+    return message
+
+
+def request_key(model_id: str, messages: list[ChatMessage | dict], **params: Any) -> str:
+    """BLAKE2b digest of the request's canonical JSON (sorted keys), so argument order does not matter.
+
+    BLAKE2b hashes long inputs faster than SHA256, and CodeAgent requests carry the whole
+    system prompt and step history.
+    """
+    payload = json.dumps(
+        {"model_id": model_id, "messages": [_message_to_dict(m) for m in messages], **params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=32).hexdigest()
+
+
+class CachedLiteLLMModel(LiteLLMModel):
+    """``LiteLLMModel`` that answers repeated requests from disk.
+
+    Args:
+        cache_path: SQLite file holding the cached replies. Created on first use.
+        **kwargs: Forwarded to ``LiteLLMModel``.
+    """
+
+    def __init__(self, *args: Any, cache_path: str | Path = DEFAULT_CACHE_PATH, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.cache_path = Path(cache_path).expanduser()
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, message TEXT NOT NULL)")
+        # Pipeline stages may share one model across threads; sqlite3 connections are not safe for that on their own.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key: str) -> ChatMessage | None:
+        with self._lock:
+            row = self._db.execute("SELECT message FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ChatMessage.from_dict(json.loads(row[0]))
+
+    def _store(self, key: str, message: ChatMessage) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, message) VALUES (?, ?)", (key, message.model_dump_json())
+            )
+
+    def _key(
+        self,
+        messages: list[ChatMessage | dict],
+        stop_sequences: list[str] | None,
+        response_format: dict[str, str] | None,
+        tools_to_call_from: list | None,
+        **kwargs: Any,
+    ) -> str:
+        # Models with the same id but other settings (max_tokens, temperature) or endpoints must not share replies.
+        # Per-call kwargs override the model's own, as they do in the request; the API key is left out.
+        return request_key(
+            self.model_id,
+            messages,
+            api_base=self.api_base,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools=[tool.name for tool in tools_to_call_from or []],
+            **{**self.kwargs, **kwargs},
+        )
+
+    def generate(
+        self,
+        messages: list[ChatMessage | dict],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list | None = None,
+        **kwargs: Any,
+    ) -> ChatMessage:
+        key = self._key(messages, stop_sequences, response_format, tools_to_call_from, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+
+        message = super().generate(
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        )
+        self._store(key, message)
+        return message
+
+    def generate_stream(
+        self,
+        messages: list[ChatMessage | dict],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list | None = None,
+        **kwargs: Any,
+    ) -> Generator[ChatMessageStreamDelta]:
+        """Stream from the provider on a miss; replay a hit as a single delta."""
+        key = self._key(messages, stop_sequences, response_format, tools_to_call_from, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield ChatMessageStreamDelta(
+                content=cached.content,
+                tool_calls=[
+                    ChatMessageToolCallStreamDelta(index=i, id=call.id, type=call.type, function=call.function)
+                    for i, call in enumerate(cached.tool_calls or [])
+                ]
+                or None,
+            )
+            return
+
+        deltas: list[ChatMessageStreamDelta] = []
+        for delta in super().generate_stream(
+            messages,
+            stop_sequences=stop_sequences,
+            response_format=response_format,
+            tools_to_call_from=tools_to_call_from,
+            **kwargs,
+        ):
+            deltas.append(delta)
+            yield delta
+        self._store(key, agglomerate_stream_deltas(deltas))
@@ -0,0 +1,48 @@
+"""Pick the cheapest model that can handle a prompt.
+
+Short read-only questions ("How many entities contains the template foo")
+are answered fine by a local Ollama model with no network round trip.
+Prompts that write to Uwazi go to Gemini Flash, and only prompts that ask
+the agent to plan several steps pay for Gemini Pro.
+"""
+
+import os
+import re
+
+from smolagents.models import LiteLLMModel
+
+from configuration import OLLAMA_BASE_URL
+from uwazi_agents.cached_model import CachedLiteLLMModel
+
+LOCAL_MODEL_ID = "ollama/qwen2.5-coder:14b-instruct-q4_K_M"
+FAST_MODEL_ID = "gemini/gemini-2.5-flash"
+PLANNER_MODEL_ID = "gemini/gemini-2.5-pro"
+
+# Every agent step resends the same CodeAgent system prompt and tool schemas. Marking the system
+# message with cache_control lets LiteLLM register it as a cached prefix on Gemini/Anthropic, so
+# later steps skip prefill for it and are billed at the cached-token rate.
+PREFIX_CACHE_KWARGS = {"cache_control_injection_points": [{"location": "message", "role": "system"}]}
+
+_MAX_SIMPLE_WORDS = 40
+_WRITE_VERBS = re.compile(r"\b(create|generate|add|update|delete|remove)\b", re.IGNORECASE)
+# "as many templates as necessary", "step by step", or a numbered list of instructions.
+_PLAN_MARKERS = re.compile(
+    r"\b(as many|as necessary|step by step|multi-step|plan)\b|^\s*\d+\.\s", re.IGNORECASE | re.MULTILINE
+)
+
+
+def model_id_for(prompt: str) -> str:
+    """Route by complexity: multi-step plan -> Pro, short read-only question -> local, else Flash."""
+    if _PLAN_MARKERS.search(prompt):
+        return PLANNER_MODEL_ID
+    if len(prompt.split()) < _MAX_SIMPLE_WORDS and not _WRITE_VERBS.search(prompt):
+        return LOCAL_MODEL_ID
+    return FAST_MODEL_ID
+
+
+def pick_model(prompt: str, **kwargs) -> LiteLLMModel:
+    """Build the routed model; ``kwargs`` go straight to ``LiteLLMModel`` (e.g. ``max_tokens``)."""
+    model_id = model_id_for(prompt)
+    if model_id.startswith("ollama/"):
+        return CachedLiteLLMModel(model_id=model_id, api_base=OLLAMA_BASE_URL, **kwargs)
+    return CachedLiteLLMModel(model_id=model_id, api_key=os.getenv("GOOGLE_API_KEY"), **PREFIX_CACHE_KWARGS, **kwargs)
@@ -110,6 +110,9 @@ def fetch_entities_dataframe(
 
     if not frames:
         return pd.DataFrame()
+    # Most calls fit in one page; concat would only copy it to renumber an index that already starts at 0.
+    if len(frames) == 1 and frames[0].index.equals(pd.RangeIndex(len(frames[0]))):
+        return frames[0]
     return pd.concat(frames, ignore_index=True)
 
 
@@ -1,13 +1,99 @@
 from smolagents import CodeAgent, LiteLLMModel, tool
 from mock_uwazi import MockUwaziAdapter as UwaziAdapter
 from config import url, user, password
+from use_cases._uwazi_common import (
+    ENTITIES_TTL,
+    ENTITY_FIELDS,
+    TEMPLATE_FIELDS,
+    TEMPLATES_TTL,
+    VALID_PROPERTY_TYPES,
+    XML_HEADER,
+    default_common_properties,
+    escape_text,
+    iter_entity_batches,
+    known_property_fields,
+    parse_fields,
+    read_with_relogin,
+)
+import io
 import json
+import time
+import xml.etree.ElementTree as ET
+from collections.abc import Iterator, Mapping
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from types import MappingProxyType
+from xml.sax.saxutils import escape
+
+try:
+    import orjson
+except ImportError:  # optional: only makes create_template's JSON output faster
+    orjson = None
+
+try:
+    import readline  # noqa: F401  (gives input() line editing and history in the interactive examples)
+except ImportError:  # not available on Windows
+    pass
+
+_HAS_CREDENTIALS = bool(url and user and password)
 
 # ============================================================================
 # HELPER TOOLS FOR AGENT CONTEXT
 # ============================================================================
 
 
+@lru_cache(maxsize=1)
+def _uwazi() -> UwaziAdapter:
+    """Authenticated adapter. Cached because login is a real HTTP round-trip."""
+    return UwaziAdapter(user=user, password=password, url=url)
+
+
+_read_from_uwazi = partial(read_with_relogin, _uwazi)
+
+
+# Agents ask for the same templates/entities several times per run, so tool output is reused for a short while.
+# Keys are (tool name, *args); values are (expiry on the monotonic clock, output), least recently used first.
+_TOOL_CACHE_SIZE = 32
+# Past its TTL an entry is only kept as a fallback for when Uwazi cannot be reached, and not for longer than this
+_TOOL_CACHE_MAX_STALE = 300.0
+_tool_cache: dict[tuple, tuple[float, str]] = {}
+
+
+def _cached(key: tuple) -> tuple[str | None, str | None]:
+    """(fresh output, last output) for ``key``; the last output is kept past its TTL as a fallback."""
+    entry = _tool_cache.pop(key, None)
+    if entry is None:
+        return None, None
+    expires, output = entry
+    now = time.monotonic()
+    if now >= expires + _TOOL_CACHE_MAX_STALE:
+        return None, None
+    _tool_cache[key] = entry
+    return (output if now < expires else None), output
+
+
+def _remember(key: tuple, ttl: float, output: str) -> str:
+    _tool_cache.pop(key, None)
+    if len(_tool_cache) >= _TOOL_CACHE_SIZE:
+        del _tool_cache[next(iter(_tool_cache))]
+    _tool_cache[key] = (time.monotonic() + ttl, output)
+    return output
+
+
+def _mark_stale(xml: str, root: str) -> str:
+    """Flag cached XML (or JSON) that is served because Uwazi could not be reached."""
+    if xml.startswith("{"):
+        return '{"stale":true,' + xml[1:]
+    start = xml.index(">", xml.index(f"<{root}")) + 1
+    if xml[start - 2] == "/":  # empty root serialized as <root />
+        return f"{xml[:start - 2].rstrip()}>\n  <stale>true</stale>\n</{root}>{xml[start:]}"
+    return f"{xml[:start]}\n  <stale>true</stale>{xml[start:]}"
+
+
+_TEMPLATES_MISSING_CREDENTIALS = f"{XML_HEADER}<templates><error>Missing credentials</error></templates>"
+_ENTITIES_MISSING_CREDENTIALS = f"{XML_HEADER}<entities><error>Missing credentials</error></entities>"
+
+
 @tool
 def analyze_existing_templates() -> str:
     """
@@ -19,39 +105,155 @@ def analyze_existing_templates() -> str:
     Returns:
         A formatted text summary of all templates and their properties.
     """
+    cache_key = ("analyze_existing_templates",)
+    fresh, _ = _cached(cache_key)
+    if fresh is not None:
+        return fresh
+
     try:
-        if not all([url, user, password]):
+        if not _HAS_CREDENTIALS:
             return "Error: Missing Uwazi credentials"
 
-        uwazi = UwaziAdapter(user=user, password=password, url=url)
-        templates = uwazi.templates.get()
+        templates = _read_from_uwazi(lambda uwazi: uwazi.templates.get())
 
         if not templates:
             return "No templates found in the database."
 
-        summary_parts = [f"Found {len(templates)} template(s):\n"]
+        summary = io.StringIO()
+        write = summary.write
+        write(f"Found {len(templates)} template(s):\n")
 
         for template in templates:
-            summary_parts.append(f"\n--- Template: {template.get('name', 'N/A')} (ID: {template.get('_id', 'N/A')}) ---")
-            summary_parts.append(f"Color: {template.get('color', 'N/A')}")
-
-            properties = template.get("properties", [])
-            summary_parts.append(f"Number of custom properties: {len(properties)}")
+            get = template.get
+            properties = get("properties") or ()
+            write(f"\n\n--- Template: {get('name', 'N/A')} (ID: {get('_id', 'N/A')}) ---")
+            write(f"\nColor: {get('color', 'N/A')}")
+            write(f"\nNumber of custom properties: {len(properties)}")
 
             if properties:
-                summary_parts.append("\nCustom Properties:")
+                write("\n\nCustom Properties:")
                 for prop in properties:
                     required_str = " (REQUIRED)" if prop.get("required") else ""
                     filter_str = " (FILTERABLE)" if prop.get("filter") else ""
-                    summary_parts.append(
-                        f"  - {prop.get('label', 'N/A')}: {prop.get('type', 'N/A')}{required_str}{filter_str}"
-                    )
+                    write(f"\n  - {prop.get('label', 'N/A')}: {prop.get('type', 'N/A')}{required_str}{filter_str}")
 
-        return "\n".join(summary_parts)
+        return _remember(cache_key, TEMPLATES_TTL, summary.getvalue())
     except Exception as e:
         return f"Error analyzing templates: {str(e)}"
 
 
+@dataclass(frozen=True, slots=True)
+class _SuggestedProperty:
+    label: str
+    type: str
+    required: bool = False
+    showInCard: bool = False
+    filter: bool = False
+
+    def as_dict(self) -> dict:
+        """Same shape create_template accepts; flags are only included when set."""
+        prop = {"label": self.label, "type": self.type}
+        for flag in ("required", "showInCard", "filter"):
+            if getattr(self, flag):
+                prop[flag] = True
+        return prop
+
+
+_DOMAIN_SUGGESTIONS: Mapping[str, tuple[_SuggestedProperty, ...]] = MappingProxyType(
+    {
+        "research paper": (
+            _SuggestedProperty("Authors", "text", required=True, showInCard=True),
+            _SuggestedProperty("Abstract", "markdown", required=True),
+            _SuggestedProperty("Publication Date", "date", filter=True),
+            _SuggestedProperty("Journal", "text", filter=True),
+            _SuggestedProperty("DOI", "link"),
+            _SuggestedProperty("Keywords", "multiselect", filter=True),
+            _SuggestedProperty("PDF", "media"),
+        ),
+        "event": (
+            _SuggestedProperty("Event Date", "date", required=True, filter=True),
+            _SuggestedProperty("Location", "geolocation", required=True),
+            _SuggestedProperty("Description", "markdown"),
+            _SuggestedProperty("Organizer", "text", showInCard=True),
+            _SuggestedProperty("Capacity", "numeric"),
+            _SuggestedProperty("Registration Link", "link"),
+            _SuggestedProperty("Event Image", "image"),
+        ),
+        "recipe": (
+            _SuggestedProperty("Ingredients", "markdown", required=True),
+            _SuggestedProperty("Instructions", "markdown", required=True),
+            _SuggestedProperty("Prep Time (minutes)", "numeric"),
+            _SuggestedProperty("Cook Time (minutes)", "numeric"),
+            _SuggestedProperty("Servings", "numeric"),
+            _SuggestedProperty("Difficulty", "select", filter=True),
+            _SuggestedProperty("Cuisine Type", "select", filter=True),
+            _SuggestedProperty("Recipe Image", "image"),
+        ),
+        "contact": (
+            _SuggestedProperty("Full Name", "text", required=True, showInCard=True),
+            _SuggestedProperty("Email", "text", required=True),
+            _SuggestedProperty("Phone", "text"),
+            _SuggestedProperty("Company", "text", filter=True),
+            _SuggestedProperty("Position", "text"),
+            _SuggestedProperty("Notes", "markdown"),
+            _SuggestedProperty("Last Contact Date", "date"),
+        ),
+        "project": (
+            _SuggestedProperty("Project Manager", "text", required=True, showInCard=True),
+            _SuggestedProperty("Description", "markdown"),
+            _SuggestedProperty("Start Date", "date", required=True, filter=True),
+            _SuggestedProperty("End Date", "date", filter=True),
+            _SuggestedProperty("Status", "select", required=True, filter=True),
+            _SuggestedProperty("Budget", "numeric"),
+            _SuggestedProperty("Team Members", "multiselect"),
+        ),
+        "product": (
+            _SuggestedProperty("Price", "numeric", required=True, showInCard=True),
+            _SuggestedProperty("Description", "markdown", required=True),
+            _SuggestedProperty("Category", "select", filter=True),
+            _SuggestedProperty("SKU", "text"),
+            _SuggestedProperty("Stock Quantity", "numeric"),
+            _SuggestedProperty("Images", "media"),
+            _SuggestedProperty("Specifications", "markdown"),
+        ),
+        "blog post": (
+            _SuggestedProperty("Author", "text", required=True, showInCard=True),
+            _SuggestedProperty("Content", "markdown", required=True),
+            _SuggestedProperty("Publish Date", "date", filter=True),
+            _SuggestedProperty("Tags", "multiselect", filter=True),
+            _SuggestedProperty("Featured Image", "image"),
+            _SuggestedProperty("Excerpt", "text"),
+            _SuggestedProperty("Status", "select", filter=True),
+        ),
+    }
+)
+
+
+@lru_cache(maxsize=256)
+def _match_domain(domain_lower: str) -> str | None:
+    """First domain (in table order) that is a substring of ``domain_lower``, or contains it."""
+    for key in _DOMAIN_SUGGESTIONS:
+        if key in domain_lower or domain_lower in key:
+            return key
+    return None
+
+
+# Seven possible answers, so they are serialized once at import time
+_SUGGESTIONS_JSON: Mapping[str, str] = MappingProxyType(
+    {
+        domain: json.dumps(
+            {
+                "domain": domain,
+                "suggested_properties": [prop.as_dict() for prop in props],
+                "usage_hint": "Pass the 'suggested_properties' array directly to create_template's properties parameter",
+            },
+            indent=2,
+        )
+        for domain, props in _DOMAIN_SUGGESTIONS.items()
+    }
+)
+
+
 @tool
 def suggest_template_properties(domain: str) -> str:
     """
@@ -66,101 +268,20 @@ def suggest_template_properties(domain: str) -> str:
     Returns:
         JSON string with suggested properties that can be used with create_template.
     """
-    domain_suggestions = {
-        "research paper": [
-            {"label": "Authors", "type": "text", "required": True, "showInCard": True},
-            {"label": "Abstract", "type": "markdown", "required": True},
-            {"label": "Publication Date", "type": "date", "filter": True},
-            {"label": "Journal", "type": "text", "filter": True},
-            {"label": "DOI", "type": "link"},
-            {"label": "Keywords", "type": "multiselect", "filter": True},
-            {"label": "PDF", "type": "media"},
-        ],
-        "event": [
-            {"label": "Event Date", "type": "date", "required": True, "filter": True},
-            {"label": "Location", "type": "geolocation", "required": True},
-            {"label": "Description", "type": "markdown"},
-            {"label": "Organizer", "type": "text", "showInCard": True},
-            {"label": "Capacity", "type": "numeric"},
-            {"label": "Registration Link", "type": "link"},
-            {"label": "Event Image", "type": "image"},
-        ],
-        "recipe": [
-            {"label": "Ingredients", "type": "markdown", "required": True},
-            {"label": "Instructions", "type": "markdown", "required": True},
-            {"label": "Prep Time (minutes)", "type": "numeric"},
-            {"label": "Cook Time (minutes)", "type": "numeric"},
-            {"label": "Servings", "type": "numeric"},
-            {"label": "Difficulty", "type": "select", "filter": True},
-            {"label": "Cuisine Type", "type": "select", "filter": True},
-            {"label": "Recipe Image", "type": "image"},
-        ],
-        "contact": [
-            {"label": "Full Name", "type": "text", "required": True, "showInCard": True},
-            {"label": "Email", "type": "text", "required": True},
-            {"label": "Phone", "type": "text"},
-            {"label": "Company", "type": "text", "filter": True},
-            {"label": "Position", "type": "text"},
-            {"label": "Notes", "type": "markdown"},
-            {"label": "Last Contact Date", "type": "date"},
-        ],
-        "project": [
-            {"label": "Project Manager", "type": "text", "required": True, "showInCard": True},
-            {"label": "Description", "type": "markdown"},
-            {"label": "Start Date", "type": "date", "required": True, "filter": True},
-            {"label": "End Date", "type": "date", "filter": True},
-            {"label": "Status", "type": "select", "required": True, "filter": True},
-            {"label": "Budget", "type": "numeric"},
-            {"label": "Team Members", "type": "multiselect"},
-        ],
-        "product": [
-            {"label": "Price", "type": "numeric", "required": True, "showInCard": True},
-            {"label": "Description", "type": "markdown", "required": True},
-            {"label": "Category", "type": "select", "filter": True},
-            {"label": "SKU", "type": "text"},
-            {"label": "Stock Quantity", "type": "numeric"},
-            {"label": "Images", "type": "media"},
-            {"label": "Specifications", "type": "markdown"},
-        ],
-        "blog post": [
-            {"label": "Author", "type": "text", "required": True, "showInCard": True},
-            {"label": "Content", "type": "markdown", "required": True},
-            {"label": "Publish Date", "type": "date", "filter": True},
-            {"label": "Tags", "type": "multiselect", "filter": True},
-            {"label": "Featured Image", "type": "image"},
-            {"label": "Excerpt", "type": "text"},
-            {"label": "Status", "type": "select", "filter": True},
-        ],
-    }
-
     domain_lower = domain.lower()
-    suggestions = None
-    matched_domain = None
+    matched_domain = _match_domain(domain_lower)
 
-    # Find matching domain
-    for key in domain_suggestions:
-        if key in domain_lower or domain_lower in key:
-            suggestions = domain_suggestions[key]
-            matched_domain = key
-            break
-
-    if not suggestions:
+    if matched_domain is None:
         return json.dumps(
             {
                 "error": f"No specific suggestions for domain '{domain}'",
                 "hint": "Consider using generic properties like: description (markdown), category (select), date (date), status (select)",
-                "available_domains": list(domain_suggestions.keys()),
+                "available_domains": list(_DOMAIN_SUGGESTIONS.keys()),
             },
             indent=2,
         )
 
-    result = {
-        "domain": matched_domain,
-        "suggested_properties": suggestions,
-        "usage_hint": "Pass the 'suggested_properties' array directly to create_template's properties parameter",
-    }
-
-    return json.dumps(result, indent=2)
+    return _SUGGESTIONS_JSON[matched_domain]
 
 
 # ============
@@ -168,8 +289,29 @@ def suggest_template_properties(domain: str) -> str:
 # ============
 
 
+def _property_dict(prop: dict, optional_keys: tuple[str, ...]) -> dict:
+    """JSON-mode counterpart of a <property> element; optional keys are only included when set."""
+    out = {"name": prop.get("name", ""), "type": prop.get("type", "")}
+    out.update((key, prop[key]) for key in optional_keys if prop.get(key))
+    return out
+
+
+def _template_dict(template: dict, requested_fields: frozenset[str]) -> dict:
+    """JSON-mode counterpart of a <template> element."""
+    out = {}
+    if "id" in requested_fields:
+        out["id"] = template.get("_id", "")
+    if "name" in requested_fields:
+        out["name"] = template.get("name", "")
+    if "properties" in requested_fields:
+        out["properties"] = [_property_dict(p, ("label", "required", "filter")) for p in template.get("properties") or ()]
+    if "commonProperties" in requested_fields:
+        out["commonProperties"] = [_property_dict(p, ("label",)) for p in template.get("commonProperties") or ()]
+    return out
+
+
 @tool
-def get_all_templates(fields: str) -> str:
+def get_all_templates(fields: str, output_format: str = "xml") -> str:
     """
     Retrieves all templates from Uwazi instance as XML with configurable field selection.
 
@@ -186,69 +328,145 @@ def get_all_templates(fields: str) -> str:
                 Available fields: id, name, properties, commonProperties
                 Example: "id,name,properties" to include template properties
                 Use "all" to include all available fields
+        output_format: "xml" (default) or "json". Use "json" when your code is going to parse
+                       the result, e.g. json.loads(result)["templates"].
 
     Returns:
-        XML formatted string containing templates with requested fields.
-        Returns empty templates element on error or if no credentials.
+        XML formatted string containing templates with requested fields, or a JSON object
+        {"templates": [...]} with the same fields when output_format is "json".
+        Returns empty templates element (or {"error": ...}) on error or if no credentials.
     """
+    as_json = output_format == "json"
+    cache_key = ("get_all_templates", fields, as_json)
+    fresh, last = _cached(cache_key)
+    if fresh is not None:
+        return fresh
+
     try:
-        if not all([url, user, password]):
-            return '<?xml version="1.0" encoding="UTF-8"?><templates><error>Missing credentials</error></templates>'
+        if not _HAS_CREDENTIALS:
+            return _dumps({"error": "Missing credentials"}, indent=False) if as_json else _TEMPLATES_MISSING_CREDENTIALS
 
-        uwazi = UwaziAdapter(user=user, password=password, url=url)
-        templates_raw = uwazi.templates.get()
+        templates_raw = _read_from_uwazi(lambda uwazi: uwazi.templates.get())
 
-        requested_fields = (
-            [f.strip() for f in fields.split(",")] if fields != "all" else ["id", "name", "properties", "commonProperties"]
-        )
+        requested_fields = parse_fields(fields, TEMPLATE_FIELDS)
+        if as_json:
+            # The agent parses this straight back into dicts, so skip building an XML tree altogether
+            templates = [_template_dict(template, requested_fields) for template in templates_raw]
+            return _remember(cache_key, TEMPLATES_TTL, _dumps({"templates": templates}, indent=False))
 
-        xml_parts = ['<?xml version="1.0" encoding="UTF-8"?>', "<templates>"]
+        want_id = "id" in requested_fields
+        want_name = "name" in requested_fields
+        want_properties = "properties" in requested_fields
+        want_common_properties = "commonProperties" in requested_fields
+        sub_element = ET.SubElement
+
+        # ElementTree escapes text for us, so names/labels containing <, & or > still yield valid XML
+        root = ET.Element("templates")
 
         for template in templates_raw:
-            xml_parts.append("  <template>")
-
-            if "id" in requested_fields:
-                xml_parts.append(f'    <id>{template.get("_id", "")}</id>')
-
-            if "name" in requested_fields:
-                xml_parts.append(f'    <name>{template.get("name", "")}</name>')
-
-            if "properties" in requested_fields:
-                xml_parts.append("    <properties>")
-                for prop in template.get("properties", []):
-                    xml_parts.append("      <property>")
-                    xml_parts.append(f'        <name>{prop.get("name", "")}</name>')
-                    xml_parts.append(f'        <type>{prop.get("type", "")}</type>')
-                    if prop.get("label"):
-                        xml_parts.append(f'        <label>{prop.get("label", "")}</label>')
-                    if prop.get("required"):
-                        xml_parts.append(f'        <required>{prop.get("required", False)}</required>')
-                    if prop.get("filter"):
-                        xml_parts.append(f'        <filter>{prop.get("filter", False)}</filter>')
-                    xml_parts.append("      </property>")
-                xml_parts.append("    </properties>")
-
-            if "commonProperties" in requested_fields:
-                xml_parts.append("    <commonProperties>")
-                for prop in template.get("commonProperties", []):
-                    xml_parts.append("      <property>")
-                    xml_parts.append(f'        <name>{prop.get("name", "")}</name>')
-                    xml_parts.append(f'        <type>{prop.get("type", "")}</type>')
-                    if prop.get("label"):
-                        xml_parts.append(f'        <label>{prop.get("label", "")}</label>')
-                    xml_parts.append("      </property>")
-                xml_parts.append("    </commonProperties>")
-
-            xml_parts.append("  </template>")
-
-        xml_parts.append("</templates>")
-        return "\n".join(xml_parts)
+            template_get = template.get
+            template_element = sub_element(root, "template")
+
+            if want_id:
+                sub_element(template_element, "id").text = str(template_get("_id", ""))
+
+            if want_name:
+                sub_element(template_element, "name").text = str(template_get("name", ""))
+
+            if want_properties:
+                properties_element = sub_element(template_element, "properties")
+                for prop in template_get("properties") or ():
+                    prop_get = prop.get
+                    property_element = sub_element(properties_element, "property")
+                    sub_element(property_element, "name").text = str(prop_get("name", ""))
+                    sub_element(property_element, "type").text = str(prop_get("type", ""))
+                    label = prop_get("label")
+                    if label:
+                        sub_element(property_element, "label").text = str(label)
+                    required = prop_get("required")
+                    if required:
+                        sub_element(property_element, "required").text = str(required)
+                    filter_ = prop_get("filter")
+                    if filter_:
+                        sub_element(property_element, "filter").text = str(filter_)
+
+            if want_common_properties:
+                common_properties_element = sub_element(template_element, "commonProperties")
+                for prop in template_get("commonProperties") or ():
+                    prop_get = prop.get
+                    property_element = sub_element(common_properties_element, "property")
+                    sub_element(property_element, "name").text = str(prop_get("name", ""))
+                    sub_element(property_element, "type").text = str(prop_get("type", ""))
+                    label = prop_get("label")
+                    if label:
+                        sub_element(property_element, "label").text = str(label)
+
+        ET.indent(root)
+        return _remember(cache_key, TEMPLATES_TTL, XML_HEADER + "\n" + ET.tostring(root, encoding="unicode"))
     except Exception as e:
-        return f'<?xml version="1.0" encoding="UTF-8"?><templates><error>{str(e)}</error></templates>'
+        if last is not None:
+            return _mark_stale(last, "templates")
+        if as_json:
+            return _dumps({"error": str(e)}, indent=False)
+        root = ET.Element("templates")
+        ET.SubElement(root, "error").text = str(e)
+        return XML_HEADER + ET.tostring(root, encoding="unicode")
+
+
+def _entity_xml(entities: list, requested_fields: frozenset[str]) -> Iterator[str]:
+    """XML fragments for a page of entities; the caller hands them to a single ``writelines``."""
+    want_id = "id" in requested_fields
+    want_shared_id = "sharedId" in requested_fields
+    want_title = "title" in requested_fields
+    want_template = "template" in requested_fields
+    want_metadata = "metadata" in requested_fields
+
+    for entity in entities:
+        yield "  <entity>\n"
+
+        if want_id and "_id" in entity:
+            yield f'    <id>{escape_text(str(entity["_id"]))}</id>\n'
+
+        if want_shared_id and "sharedId" in entity:
+            yield f'    <sharedId>{escape_text(str(entity["sharedId"]))}</sharedId>\n'
+
+        if want_title and "title" in entity:
+            yield f'    <title>{escape_text(str(entity["title"]))}</title>\n'
+
+        if want_template and "template" in entity:
+            yield f'    <template>{escape_text(str(entity["template"]))}</template>\n'
+
+        metadata = entity.get("metadata") if want_metadata else None
+        if metadata:
+            yield "    <metadata>\n"
+            for key, value in metadata.items():
+                # Handle lists/arrays in metadata
+                if isinstance(value, list):
+                    # One fragment per field: multiselect/relationship values can hold hundreds of items
+                    items = "".join([f"        <item>{escape_text(str(item))}</item>\n" for item in value])
+                    yield f"      <{key}>\n{items}      </{key}>\n"
+                else:
+                    yield f"      <{key}>{escape_text(str(value))}</{key}>\n"
+            yield "    </metadata>\n"
+
+        yield "  </entity>\n"
+
+
+_ENTITY_JSON_KEYS = (("id", "_id"), ("sharedId", "sharedId"), ("title", "title"), ("template", "template"))
+
+
+def _entity_dict(entity: dict, requested_fields: frozenset[str]) -> dict:
+    """JSON-mode counterpart of an <entity> element."""
+    out = {name: entity[key] for name, key in _ENTITY_JSON_KEYS if name in requested_fields and key in entity}
+    if "metadata" in requested_fields and entity.get("metadata"):
+        out["metadata"] = entity["metadata"]
+    return out
 
 
 @tool
-def get_all_entities(template_id: str, fields: str, batch_size: int = 30, language: str = "en") -> str:
+def get_all_entities(
+    template_id: str, fields: str, batch_size: int = 30, language: str = "en", output_format: str = "xml"
+) -> str:
     """
     Retrieves all entities for a given template from Uwazi instance as XML with configurable field selection.
 
@@ -268,73 +486,68 @@ def get_all_entities(template_id: str, fields: str, batch_size: int = 30, langua
                 Use "all" to include all available fields
         batch_size: The number of entities to retrieve per batch (default: 30).
         language: The language in which to retrieve the entities (default: "en").
+        output_format: "xml" (default) or "json". Use "json" when your code is going to parse
+                       the result, e.g. json.loads(result)["entities"].
 
     Returns:
-        XML formatted string containing entities with requested fields.
-        Returns empty entities element on error or if no credentials.
+        XML formatted string containing entities with requested fields, or a JSON object
+        {"count": ..., "entities": [...]} with the same fields when output_format is "json".
+        Returns empty entities element (or {"error": ...}) on error or if no credentials.
     """
-    try:
-        if not all([url, user, password]):
-            return '<?xml version="1.0" encoding="UTF-8"?><entities><error>Missing credentials</error></entities>'
-
-        uwazi = UwaziAdapter(user=user, password=password, url=url)
-        entities = []
-        start_from = 0
-        while True:
-            batch = uwazi.entities.get(
-                start_from=start_from, batch_size=batch_size, template_id=template_id, language=language
-            )
-            if not batch:
-                break
-            entities.extend(batch)
-            if len(batch) < batch_size:
-                break
-            start_from += batch_size
-
-        requested_fields = (
-            [f.strip() for f in fields.split(",")]
-            if fields != "all"
-            else ["id", "sharedId", "title", "template", "metadata"]
-        )
-
-        xml_parts = ['<?xml version="1.0" encoding="UTF-8"?>', f'<entities count="{len(entities)}">']
-
-        for entity in entities:
-            xml_parts.append("  <entity>")
-
-            if "id" in requested_fields and "_id" in entity:
-                xml_parts.append(f'    <id>{entity.get("_id", "")}</id>')
-
-            if "sharedId" in requested_fields and "sharedId" in entity:
-                xml_parts.append(f'    <sharedId>{entity.get("sharedId", "")}</sharedId>')
-
-            if "title" in requested_fields and "title" in entity:
-                xml_parts.append(f'    <title>{entity.get("title", "")}</title>')
+    as_json = output_format == "json"
+    cache_key = ("get_all_entities", template_id, fields, batch_size, language, as_json)
+    fresh, last = _cached(cache_key)
+    if fresh is not None:
+        return fresh
 
-            if "template" in requested_fields and "template" in entity:
-                xml_parts.append(f'    <template>{entity.get("template", "")}</template>')
+    try:
+        if not _HAS_CREDENTIALS:
+            return _dumps({"error": "Missing credentials"}, indent=False) if as_json else _ENTITIES_MISSING_CREDENTIALS
+
+        requested_fields = parse_fields(fields, ENTITY_FIELDS)
+
+        def render(uwazi) -> str:
+            # Each page is written out as soon as it arrives, so only one page of entity dicts is alive at a time
+            xml = io.StringIO()
+            count = 0
+            for batch in iter_entity_batches(uwazi, template_id, batch_size, language):
+                count += len(batch)
+                xml.writelines(_entity_xml(batch, requested_fields))
+            xml.write("</entities>")
+            return f'{XML_HEADER}\n<entities count="{count}">\n' + xml.getvalue()
+
+        def render_json(uwazi) -> str:
+            entities = [
+                _entity_dict(entity, requested_fields)
+                for batch in iter_entity_batches(uwazi, template_id, batch_size, language)
+                for entity in batch
+            ]
+            return _dumps({"count": len(entities), "entities": entities}, indent=False)
+
+        return _remember(cache_key, ENTITIES_TTL, _read_from_uwazi(render_json if as_json else render))
+    except Exception as e:
+        if last is not None:
+            return _mark_stale(last, "entities")
+        if as_json:
+            return _dumps({"error": str(e)}, indent=False)
+        return f"{XML_HEADER}<entities><error>{escape(str(e))}</error></entities>"
+
+
+_WARNINGS: Mapping[str, str] = MappingProxyType(
+    {
+        "not_a_dict": "Property at index {} is not a dictionary, skipping",
+        "missing_type": "Property at index {} missing 'type' field, skipping",
+        "invalid_type": "Property at index {} has invalid type '{}', skipping",
+        "missing_label": "Property at index {} missing 'label', using empty string",
+    }
+)
 
-            if "metadata" in requested_fields and "metadata" in entity:
-                metadata = entity.get("metadata", {})
-                if metadata:
-                    xml_parts.append("    <metadata>")
-                    for key, value in metadata.items():
-                        # Handle lists/arrays in metadata
-                        if isinstance(value, list):
-                            xml_parts.append(f"      <{key}>")
-                            for item in value:
-                                xml_parts.append(f"        <item>{item}</item>")
-                            xml_parts.append(f"      </{key}>")
-                        else:
-                            xml_parts.append(f"      <{key}>{value}</{key}>")
-                    xml_parts.append("    </metadata>")
 
-            xml_parts.append("  </entity>")
-
-        xml_parts.append("</entities>")
-        return "\n".join(xml_parts)
-    except Exception as e:
-        return f'<?xml version="1.0" encoding="UTF-8"?><entities><error>{str(e)}</error></entities>'
+def _dumps(obj, indent: bool = True) -> str:
+    """JSON for the tools' replies, through orjson when it is installed. ``indent=False`` gives compact output."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None).decode()
+    return json.dumps(obj, indent=2) if indent else json.dumps(obj, separators=(",", ":"))
 
 
 @tool
@@ -381,66 +594,35 @@ def create_template(name: str, properties: list[dict], color: str = "#000000", l
         )
     """
     try:
-        if not all([url, user, password]):
-            return json.dumps({"error": "Missing required environment variables (UWAZI_URL, UWAZI_USER, UWAZI_PASSWORD)"})
-
-        uwazi = UwaziAdapter(user=user, password=password, url=url)
-
-        valid_property_fields = {
-            "label",
-            "type",
-            "name",
-            "required",
-            "showInCard",
-            "filter",
-            "defaultfilter",
-            "prioritySorting",
-            "noLabel",
-            "style",
-            "generatedId",
-            "isCommonProperty",
-        }
+        if not _HAS_CREDENTIALS:
+            return _dumps({"error": "Missing required environment variables (UWAZI_URL, UWAZI_USER, UWAZI_PASSWORD)"})
 
-        valid_property_types = {
-            "text",
-            "markdown",
-            "numeric",
-            "date",
-            "link",
-            "select",
-            "multiselect",
-            "relationship",
-            "nested",
-            "image",
-            "media",
-            "preview",
-            "geolocation",
-        }
+        uwazi = _uwazi()
 
         cleaned_properties = []
-        validation_warnings = []
+        # (code, index, *details); formatted only once the template has actually been created
+        validation_warnings: list[tuple] = []
 
         for idx, prop in enumerate(properties):
             if not isinstance(prop, dict):
-                validation_warnings.append(f"Property at index {idx} is not a dictionary, skipping")
+                validation_warnings.append(("not_a_dict", idx))
                 continue
 
             if "type" not in prop:
-                validation_warnings.append(f"Property at index {idx} missing 'type' field, skipping")
+                validation_warnings.append(("missing_type", idx))
                 continue
 
-            if prop["type"] not in valid_property_types:
-                validation_warnings.append(f"Property at index {idx} has invalid type '{prop['type']}', skipping")
+            if prop["type"] not in VALID_PROPERTY_TYPES:
+                validation_warnings.append(("invalid_type", idx, prop["type"]))
                 continue
 
-            cleaned_prop = {key: value for key, value in prop.items() if key in valid_property_fields}
+            cleaned_prop = known_property_fields(prop)
 
             if "label" not in cleaned_prop:
                 cleaned_prop["label"] = ""
-                validation_warnings.append(f"Property at index {idx} missing 'label', using empty string")
-
-            # Auto-generate name from label if not provided
-            if "name" not in cleaned_prop and cleaned_prop.get("label"):
+                validation_warnings.append(("missing_label", idx))
+            elif "name" not in cleaned_prop and cleaned_prop["label"]:
+                # Auto-generate name from label if not provided
                 cleaned_prop["name"] = cleaned_prop["label"].lower().replace(" ", "_")
 
             cleaned_properties.append(cleaned_prop)
@@ -450,22 +632,22 @@ def create_template(name: str, properties: list[dict], color: str = "#000000", l
             "color": color,
             "entityViewPage": "",
             "properties": cleaned_properties,
-            "commonProperties": [
-                {"label": "Title", "name": "title", "type": "text", "isCommonProperty": True},
-                {"label": "Date added", "name": "creationDate", "type": "date", "isCommonProperty": True},
-                {"label": "Date modified", "name": "editDate", "type": "date", "isCommonProperty": True},
-            ],
+            "commonProperties": default_common_properties(),
         }
 
         result = uwazi.templates.set(language=language, template=template_dict)
+        # The cached template listings no longer include the new template
+        _tool_cache.clear()
 
         # Add validation warnings to result
         if validation_warnings:
-            result["validation_warnings"] = validation_warnings
+            result["validation_warnings"] = [_WARNINGS[code].format(*args) for code, *args in validation_warnings]
 
-        return json.dumps(result, indent=2)
+        return _dumps(result)
     except Exception as e:
-        return json.dumps({"error": f"Error creating template: {str(e)}"})
+        # Writes are not retried, but a stale session should not break the next call
+        _uwazi.cache_clear()
+        return _dumps({"error": f"Error creating template: {str(e)}"})
 
 
 # ============================================================================
@@ -473,7 +655,18 @@ def create_template(name: str, properties: list[dict], color: str = "#000000", l
 # ============================================================================
 
 
-def create_uwazi_agent(model):
+UWAZI_TOOLS = (
+    analyze_existing_templates,
+    suggest_template_properties,
+    get_all_templates,
+    get_all_entities,
+    create_template,
+)
+
+DEMO_MODEL_ID = "ollama/qwen2.5-coder:14b-instruct-q4_K_M"
+
+
+def create_uwazi_agent(model, **kwargs):
     """
     Creates an agent that can intelligently manage Uwazi templates.
 
@@ -485,27 +678,36 @@ def create_uwazi_agent(model):
 
     Args:
         model: LiteLLMModel or other smolagents-compatible model
+        **kwargs: Extra CodeAgent arguments, e.g. max_steps
 
     Returns:
         Configured CodeAgent instance
     """
-    from smolagents import CodeAgent
-
     agent = CodeAgent(
-        tools=[
-            analyze_existing_templates,
-            suggest_template_properties,
-            get_all_templates,
-            get_all_entities,
-            create_template,
-        ],
+        tools=list(UWAZI_TOOLS),
         model=model,
         additional_authorized_imports=["json"],
+        use_structured_outputs_internally=True,
+        **kwargs,
     )
 
     return agent
 
 
+@lru_cache(maxsize=1)
+def _get_model() -> LiteLLMModel:
+    return LiteLLMModel(model_id=DEMO_MODEL_ID)
+
+
+@lru_cache(maxsize=None)
+def _get_agent(max_steps: int = 20) -> CodeAgent:
+    """Agent shared by the examples below, so only the first one pays for building the model and system prompt.
+
+    agent.run() starts from a fresh memory by default, so sharing it does not leak context between examples.
+    """
+    return create_uwazi_agent(_get_model(), max_steps=max_steps)
+
+
 def main():
     """
     Demonstrates various ways to use the Uwazi agent.
@@ -515,23 +717,7 @@ def main():
     # SETUP: Create the agent
     # ========================================================================
 
-    model = LiteLLMModel(
-        model_id="ollama/qwen2.5-coder:14b",  # or any other model
-        # api_base="http://localhost:11434",  # if using local Ollama
-    )
-
-    agent = CodeAgent(
-        tools=[
-            analyze_existing_templates,
-            suggest_template_properties,
-            get_all_templates,
-            get_all_entities,
-            create_template,
-        ],
-        model=model,
-        additional_authorized_imports=["json"],
-        max_steps=10,  # Limit steps to prevent infinite loops
-    )
+    agent = _get_agent(max_steps=10)  # Limit steps to prevent infinite loops
 
     print("🤖 Uwazi Agent initialized!\n")
 
@@ -642,10 +828,18 @@ def main():
     print("You can now chat with the agent interactively!")
     print("Type 'quit' or 'exit' to stop.\n")
 
+    chat(agent)
+
+
+def chat(agent):
+    """Read prompts from the terminal and answer them with ``agent`` until the user quits."""
     while True:
-        user_input = input("You: ").strip()
+        try:
+            user_input = input("You: ").strip()
+        except EOFError:
+            user_input = "quit"
 
-        if user_input.lower() in ["quit", "exit", "q"]:
+        if user_input.lower() in ("quit", "exit", "q"):
             print("👋 Goodbye!")
             break
 
@@ -667,18 +861,7 @@ def main():
 def quick_examples():
     """Quick one-liner examples for common tasks"""
 
-    model = LiteLLMModel(model_id="ollama/qwen2.5-coder:14b")
-    agent = CodeAgent(
-        tools=[
-            analyze_existing_templates,
-            suggest_template_properties,
-            get_all_templates,
-            get_all_entities,
-            create_template,
-        ],
-        model=model,
-        additional_authorized_imports=["json"],
-    )
+    agent = _get_agent()
 
     # Quick task 1: Just analyze
     print("📊 Quick Analysis:")
@@ -735,18 +918,7 @@ def robust_agent_run(agent, task, max_retries=3):
 def advanced_example():
     """Example with error handling"""
 
-    model = LiteLLMModel(model_id="ollama/qwen2.5-coder:14b")
-    agent = CodeAgent(
-        tools=[
-            analyze_existing_templates,
-            suggest_template_properties,
-            get_all_templates,
-            get_all_entities,
-            create_template,
-        ],
-        model=model,
-        additional_authorized_imports=["json"],
-    )
+    agent = _get_agent()
 
     task = """
     Create an 'Event' template for managing conferences and workshops.
@@ -766,18 +938,7 @@ def advanced_example():
 def batch_create_templates():
     """Create multiple templates in one session"""
 
-    model = LiteLLMModel(model_id="ollama/qwen2.5-coder:14b")
-    agent = CodeAgent(
-        tools=[
-            analyze_existing_templates,
-            suggest_template_properties,
-            get_all_templates,
-            get_all_entities,
-            create_template,
-        ],
-        model=model,
-        additional_authorized_imports=["json"],
-    )
+    agent = _get_agent()
 
     templates_to_create = [
         {"name": "Event", "description": "conferences and workshops with date, location, organizer", "color": "#DC2626"},
@@ -813,18 +974,7 @@ def batch_create_templates():
 def conversational_example():
     """Example showing multi-turn conversation with context"""
 
-    model = LiteLLMModel(model_id="ollama/qwen2.5-coder:14b")
-    agent = CodeAgent(
-        tools=[
-            analyze_existing_templates,
-            suggest_template_properties,
-            get_all_templates,
-            get_all_entities,
-            create_template,
-        ],
-        model=model,
-        additional_authorized_imports=["json"],
-    )
+    agent = _get_agent()
 
     conversation = [
         "What templates currently exist in the system?",
@@ -884,33 +1034,12 @@ if __name__ == "__main__":
         conversational_example()
     elif choice == "6":
         # Just run interactive mode
-        model = LiteLLMModel(model_id="ollama/qwen2.5-coder:14b")
-        agent = CodeAgent(
-            tools=[
-                analyze_existing_templates,
-                suggest_template_properties,
-                get_all_templates,
-                get_all_entities,
-                create_template,
-            ],
-            model=model,
-            additional_authorized_imports=["json"],
-        )
+        agent = _get_agent()
 
         print("\n💬 Interactive Mode - Chat with the agent!")
         print("Type 'quit' to exit.\n")
 
-        while True:
-            user_input = input("You: ").strip()
-            if user_input.lower() in ["quit", "exit", "q"]:
-                print("👋 Goodbye!")
-                break
-            if user_input:
-                try:
-                    result = agent.run(user_input)
-                    print(f"\n🤖 Agent: {result}\n")
-                except Exception as e:
-                    print(f"\n❌ Error: {str(e)}\n")
+        chat(agent)
     else:
         print("Invalid choice. Running full demo...")
         main()
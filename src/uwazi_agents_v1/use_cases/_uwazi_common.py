@@ -0,0 +1,156 @@
+"""Pieces shared by the Uwazi tools in ``create_template.py`` and ``uwazi_agent_interface.py``.
+
+Both modules talk to Uwazi through their own cached adapter (the interface uses the real
+``UwaziAdapter``, the create_template demo a mock), so everything here takes the adapter or its
+factory as an argument.
+"""
+
+import os
+from collections.abc import Callable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
+from xml.sax.saxutils import escape
+
+from requests.exceptions import HTTPError
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+
+TEMPLATE_FIELDS = frozenset({"id", "name", "properties", "commonProperties"})
+ENTITY_FIELDS = frozenset({"id", "sharedId", "title", "template", "metadata"})
+
+# How long a fetched template list / entity export may be reused, in seconds
+TEMPLATES_TTL = float(os.getenv("UWAZI_CACHE_TTL_TEMPLATES", "15"))
+ENTITIES_TTL = float(os.getenv("UWAZI_CACHE_TTL_ENTITIES", "5"))
+
+# Entity pages fetched concurrently once the first page shows there are more; the window doubles after
+# every full one up to the maximum, which stays within the interface's keep-alive pool of 20 connections
+ENTITY_FETCH_FIRST_WINDOW = 2
+ENTITY_FETCH_MAX_WORKERS = 16
+
+VALID_PROPERTY_FIELDS = frozenset(
+    {
+        "label",
+        "type",
+        "name",
+        "required",
+        "showInCard",
+        "filter",
+        "defaultfilter",
+        "prioritySorting",
+        "noLabel",
+        "style",
+        "generatedId",
+        "isCommonProperty",
+    }
+)
+
+VALID_PROPERTY_TYPES = frozenset(
+    {
+        "text",
+        "markdown",
+        "numeric",
+        "date",
+        "link",
+        "select",
+        "multiselect",
+        "relationship",
+        "nested",
+        "image",
+        "media",
+        "preview",
+        "geolocation",
+    }
+)
+
+_DEFAULT_COMMON_PROPERTIES: tuple[Mapping[str, str | bool], ...] = (
+    MappingProxyType({"label": "Title", "name": "title", "type": "text", "isCommonProperty": True}),
+    MappingProxyType({"label": "Date added", "name": "creationDate", "type": "date", "isCommonProperty": True}),
+    MappingProxyType({"label": "Date modified", "name": "editDate", "type": "date", "isCommonProperty": True}),
+)
+
+# Responses that mean the cached session is no longer logged in
+_AUTH_FAILURE_STATUSES = frozenset({401, 403})
+
+# Titles, labels, ids and select values repeat across templates and entities, so most escapes are cache hits
+escape_text = lru_cache(maxsize=4096)(escape)
+
+
+@lru_cache(maxsize=64)
+def parse_fields(fields: str, all_fields: frozenset[str]) -> frozenset[str]:
+    """The ``fields`` argument of the XML tools as a set; agents pass the same few strings over and over."""
+    if fields == "all":
+        return all_fields
+    return frozenset(f.strip() for f in fields.split(","))
+
+
+def _is_auth_failure(error: HTTPError) -> bool:
+    return error.response is not None and error.response.status_code in _AUTH_FAILURE_STATUSES
+
+
+def read_with_relogin(uwazi: Callable, read: Callable):
+    """Run ``read(uwazi())``; if Uwazi rejects the session, log in again once and retry.
+
+    ``uwazi`` is an ``lru_cache``'d adapter factory, cleared to force the new login. Any other error is
+    raised as is: connection errors are already retried by the HTTP adapter, and re-running a multi-page
+    read for a bad response would only fetch every page again.
+    """
+    try:
+        return read(uwazi())
+    except HTTPError as e:
+        if not _is_auth_failure(e):
+            raise
+    uwazi.cache_clear()
+    return read(uwazi())
+
+
+def known_property_fields(prop: dict) -> dict:
+    """Copy of ``prop`` without the keys Uwazi does not accept on a template property."""
+    # Agents almost always send only known keys, so the usual case is a plain C-level copy
+    if prop.keys() <= VALID_PROPERTY_FIELDS:
+        return prop.copy()
+    return {key: value for key, value in prop.items() if key in VALID_PROPERTY_FIELDS}
+
+
+def default_common_properties() -> list[dict]:
+    """The system properties every new template gets, as fresh dicts the adapter is free to fill in ids on."""
+    return [dict(prop) for prop in _DEFAULT_COMMON_PROPERTIES]
+
+
+def iter_entity_batches(uwazi, template_id: str, batch_size: int, language: str) -> Iterator[list]:
+    """Yield the entity pages of a template in offset order.
+
+    The first page tells whether there is more than one; after that, pages are requested in concurrent
+    windows of ENTITY_FETCH_FIRST_WINDOW pages, doubling after every full window up to
+    ENTITY_FETCH_MAX_WORKERS. A large template costs a few round trips instead of one per page, and a
+    small one requests at most one window's worth of pages past its last (never more than the pages
+    already fetched), all of which finish before the generator returns.
+
+    A partial (or empty) first page ends the fetch after a single request. The adapter does not report
+    a total count, so when the last page is exactly ``batch_size`` long the end is only seen from an
+    empty page; that request normally rides along in the same concurrent window and costs no extra round trip.
+    """
+
+    def fetch(start_from: int) -> list:
+        return uwazi.entities.get(start_from=start_from, batch_size=batch_size, template_id=template_id, language=language)
+
+    batch = fetch(0)
+    if not batch:
+        return
+    yield batch
+    if len(batch) < batch_size:
+        return
+
+    start_from = batch_size
+    window = ENTITY_FETCH_FIRST_WINDOW
+    with ThreadPoolExecutor(max_workers=ENTITY_FETCH_MAX_WORKERS) as executor:
+        while True:
+            offsets = range(start_from, start_from + window * batch_size, batch_size)
+            for batch in executor.map(fetch, offsets):
+                if not batch:
+                    return
+                yield batch
+                if len(batch) < batch_size:
+                    return
+            start_from = offsets.stop
+            window = min(2 * window, ENTITY_FETCH_MAX_WORKERS)
@@ -1,7 +1,179 @@
+import io
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial, wraps
+from itertools import chain
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
 from smolagents import tool
+from urllib3.util.retry import Retry
 from uwazi_api.UwaziAdapter import UwaziAdapter
 
 from uwazi_agents.config import url, user, password
+from uwazi_agents_v1.use_cases._uwazi_common import (
+    ENTITY_FIELDS,
+    TEMPLATE_FIELDS,
+    TEMPLATES_TTL,
+    VALID_PROPERTY_TYPES,
+    XML_HEADER,
+    default_common_properties,
+    escape_text,
+    iter_entity_batches,
+    known_property_fields,
+    parse_fields,
+    read_with_relogin,
+)
+
+try:
+    import orjson
+except ImportError:  # optional: only makes request bodies faster to encode
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Errors a tool reports to the agent as an empty/error result: Uwazi unreachable or answering with unexpected data.
+# Anything else is a bug and propagates, so smolagents shows the traceback instead of an empty document.
+_UWAZI_ERRORS = (RequestException, KeyError, ValueError, TypeError)
+
+# Upper bound on concurrent templates.set requests issued by create_templates_bulk
+_BULK_CREATE_WORKERS = 10
+
+# Keep-alive connections per host; enough for concurrent entity pages and bulk template creation
+_HTTP_POOL_SIZE = 20
+
+# Credentials come from the environment once at import, so checking them per tool call is wasted work
+_HAS_CREDENTIALS = bool(url and user and password)
+
+# Rendered get_all_templates XML, keyed by (field set, template ids and versions). The key changes when a template
+# is saved through the API; the TTL bounds how long an edit that leaves the version alone can go unseen.
+_TEMPLATES_XML_TTL = 30.0
+_TEMPLATES_XML_CACHE_SIZE = 8
+_templates_xml_cache: dict[tuple, tuple[float, str]] = {}
+
+# Raw templates.get() result, reused for TEMPLATES_TTL seconds so back-to-back tool calls share one request
+_templates_cache: dict[str, tuple[float, list]] = {}
+
+
+def _use_connection_pool(adapter: UwaziAdapter) -> UwaziAdapter:
+    """Mount a larger keep-alive pool on every ``requests.Session`` the adapter and its sub-clients hold.
+
+    UwaziAdapter takes no session argument, so the sessions are found on its attributes. Idempotent
+    requests are retried on connection errors; POSTs (template creation) are not. With orjson installed,
+    JSON bodies are encoded and decoded by it.
+    """
+    http = HTTPAdapter(pool_connections=10, pool_maxsize=_HTTP_POOL_SIZE, max_retries=Retry(total=3, backoff_factor=0.2))
+    for owner in (adapter, *vars(adapter).values()):
+        for value in getattr(owner, "__dict__", {}).values():
+            # Sub-clients usually share the adapter's session, so the same one is reached several times
+            if isinstance(value, requests.Session) and not getattr(value, "_uwazi_pooled", False):
+                value._uwazi_pooled = True
+                value.mount("http://", http)
+                value.mount("https://", http)
+                if orjson is not None:
+                    _encode_json_with_orjson(value)
+                    value.hooks["response"].append(_decode_json_with_orjson)
+    return adapter
+
+
+def _encode_json_with_orjson(session: requests.Session) -> None:
+    """Have ``session`` encode ``json=`` bodies with orjson, which emits compact bytes ready to send.
+
+    Template payloads carry every property, and requests would otherwise run them through ``json.dumps``
+    with whitespace separators and then encode the result to bytes.
+    """
+    request = session.request
+
+    def request_with_orjson(method, url, *args, json=None, **kwargs):
+        if json is not None and not args and kwargs.get("data") is None:
+            kwargs["data"] = orjson.dumps(json)
+            kwargs["headers"] = {"Content-Type": "application/json", **(kwargs.get("headers") or {})}
+            json = None
+        return request(method, url, *args, json=json, **kwargs)
+
+    session.request = request_with_orjson
+
+
+def _decode_json_with_orjson(response: requests.Response, *args, **kwargs) -> requests.Response:
+    """Response hook making ``response.json()`` parse the raw body with orjson.
+
+    Entity pages are the largest responses the tools read; orjson parses the bytes directly instead of
+    decoding them to str and running the stdlib parser. Anything orjson rejects, or a call with parser
+    arguments, goes through requests' own ``json()`` so callers still get its exceptions.
+    """
+    parse = response.json
+
+    def json_with_orjson(**json_kwargs):
+        if not json_kwargs:
+            try:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError:
+                pass
+        return parse(**json_kwargs)
+
+    response.json = json_with_orjson
+    return response
+
+
+_EMPTY_TEMPLATES = f"{XML_HEADER}<templates></templates>"
+_EMPTY_ENTITIES = f"{XML_HEADER}<entities></entities>"
+_ENTITIES_OPEN = f"{XML_HEADER}\n<entities>\n"
+
+
+@lru_cache(maxsize=1)
+def _uwazi() -> UwaziAdapter:
+    """Logged-in adapter with the larger connection pool, built once per process (or after a failed call)."""
+    return _use_connection_pool(UwaziAdapter(user=user, password=password, url=url))
+
+
+def _timed(fn):
+    """Log how long each call of ``fn`` takes at DEBUG level; a plain call when DEBUG is off."""
+
+    @wraps(fn)
+    def timed(*args, **kwargs):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            logger.debug("%s took %.3fs", fn.__qualname__, time.perf_counter() - start)
+
+    return timed
+
+
+_read_from_uwazi = partial(read_with_relogin, _uwazi)
+
+
+@_timed
+def _get_templates() -> list:
+    """All templates, fetched at most once per ``TEMPLATES_TTL`` seconds; creating a template drops the copy."""
+    entry = _templates_cache.get("templates")
+    if entry is not None and time.monotonic() < entry[0]:
+        return entry[1]
+    templates = _read_from_uwazi(lambda uwazi: uwazi.templates.get())
+    _templates_cache["templates"] = (time.monotonic() + TEMPLATES_TTL, templates)
+    return templates
+
+
+def _add_property_elements(parent: ET.Element, properties: Iterable[dict]) -> None:
+    """Append a ``<property>`` with name, type and (if set) label under ``parent`` for each property."""
+    sub_element = ET.SubElement
+    for prop in properties:
+        prop_get = prop.get
+        property_element = sub_element(parent, "property")
+        sub_element(property_element, "name").text = str(prop_get("name", ""))
+        sub_element(property_element, "type").text = str(prop_get("type", ""))
+        label = prop_get("label")
+        if label:
+            sub_element(property_element, "label").text = str(label)
 
 
 @tool
@@ -25,62 +197,151 @@ def get_all_templates(fields: str) -> str:
 
     Returns:
         str: XML formatted string containing templates with requested fields.
-             Returns empty templates element on error or if no credentials.
+             Returns empty templates element if no credentials, or if Uwazi cannot be reached or
+             returns unexpected data. Any other error is raised.
     """
     try:
-        if not all([url, user, password]):
-            return '<?xml version="1.0" encoding="UTF-8"?><templates></templates>'
+        if not _HAS_CREDENTIALS:
+            return _EMPTY_TEMPLATES
 
-        uwazi = UwaziAdapter(user=user, password=password, url=url)
-        templates_raw = uwazi.templates.get()
+        templates_raw = _get_templates()
 
-        requested_fields = (
-            [f.strip() for f in fields.split(",")] if fields != "all" else ["id", "name", "properties", "commonProperties"]
-        )
+        requested_fields = parse_fields(fields, TEMPLATE_FIELDS)
 
-        xml_parts = ['<?xml version="1.0" encoding="UTF-8"?>', "<templates>"]
+        # Templates rarely change, so the same XML is usually rendered again on every agent step
+        cache_key = (requested_fields, tuple((template.get("_id"), template.get("__v")) for template in templates_raw))
+        cached = _templates_xml_cache.get(cache_key)
+        if cached is not None and time.monotonic() < cached[0]:
+            return cached[1]
+
+        want_id = "id" in requested_fields
+        want_name = "name" in requested_fields
+        want_properties = "properties" in requested_fields
+        want_common_properties = "commonProperties" in requested_fields
+        sub_element = ET.SubElement
+
+        # ElementTree serializes and escapes in C, so names/labels containing <, & or > still yield valid XML
+        root = ET.Element("templates")
 
         for template in templates_raw:
-            xml_parts.append("  <template>")
-
-            if "id" in requested_fields:
-                xml_parts.append(f'    <id>{template.get("_id", "")}</id>')
-
-            if "name" in requested_fields:
-                xml_parts.append(f'    <name>{template.get("name", "")}</name>')
-
-            if "properties" in requested_fields:
-                xml_parts.append("    <properties>")
-                for prop in template.get("properties", []):
-                    xml_parts.append("      <property>")
-                    xml_parts.append(f'        <name>{prop.get("name", "")}</name>')
-                    xml_parts.append(f'        <type>{prop.get("type", "")}</type>')
-                    if prop.get("label"):
-                        xml_parts.append(f'        <label>{prop.get("label", "")}</label>')
-                    xml_parts.append("      </property>")
-                xml_parts.append("    </properties>")
-
-            if "commonProperties" in requested_fields:
-                xml_parts.append("    <commonProperties>")
-                for prop in template.get("commonProperties", []):
-                    xml_parts.append("      <property>")
-                    xml_parts.append(f'        <name>{prop.get("name", "")}</name>')
-                    xml_parts.append(f'        <type>{prop.get("type", "")}</type>')
-                    if prop.get("label"):
-                        xml_parts.append(f'        <label>{prop.get("label", "")}</label>')
-                    xml_parts.append("      </property>")
-                xml_parts.append("    </commonProperties>")
-
-            xml_parts.append("  </template>")
-
-        xml_parts.append("</templates>")
-        return "\n".join(xml_parts)
-    except Exception as e:
-        return '<?xml version="1.0" encoding="UTF-8"?><templates></templates>'
+            template_get = template.get
+            template_element = sub_element(root, "template")
+
+            if want_id:
+                sub_element(template_element, "id").text = str(template_get("_id", ""))
+
+            if want_name:
+                sub_element(template_element, "name").text = str(template_get("name", ""))
+
+            if want_properties:
+                _add_property_elements(sub_element(template_element, "properties"), template_get("properties") or ())
+
+            if want_common_properties:
+                _add_property_elements(
+                    sub_element(template_element, "commonProperties"), template_get("commonProperties") or ()
+                )
+
+        ET.indent(root)
+        xml = XML_HEADER + "\n" + ET.tostring(root, encoding="unicode")
+        if len(_templates_xml_cache) >= _TEMPLATES_XML_CACHE_SIZE:
+            del _templates_xml_cache[next(iter(_templates_xml_cache))]
+        _templates_xml_cache[cache_key] = (time.monotonic() + _TEMPLATES_XML_TTL, xml)
+        return xml
+    except _UWAZI_ERRORS as e:
+        logger.warning("get_all_templates failed: %s", e)
+        return _EMPTY_TEMPLATES
+
+
+def _counted_batches(batches: Iterator[list], stats: dict[str, float]) -> Iterator[list]:
+    """Pass ``batches`` through, adding to ``stats`` the pages, entities and seconds spent waiting for each page."""
+    while True:
+        start = time.perf_counter()
+        batch = next(batches, None)
+        stats["fetch"] += time.perf_counter() - start
+        if batch is None:
+            return
+        stats["pages"] += 1
+        stats["entities"] += len(batch)
+        yield batch
+
+
+def _write_entities(write, entities: Iterable[dict], requested_fields: frozenset[str]) -> None:
+    """Write the ``<entity>`` elements for ``entities``, keeping only ``requested_fields``."""
+    want_id = "id" in requested_fields
+    want_shared_id = "sharedId" in requested_fields
+    want_title = "title" in requested_fields
+    want_template = "template" in requested_fields
+    want_metadata = "metadata" in requested_fields
+
+    for entity in entities:
+        write("  <entity>\n")
+
+        if want_id and "_id" in entity:
+            write(f'    <id>{escape_text(str(entity["_id"]))}</id>\n')
+
+        if want_shared_id and "sharedId" in entity:
+            write(f'    <sharedId>{escape_text(str(entity["sharedId"]))}</sharedId>\n')
+
+        if want_title and "title" in entity:
+            write(f'    <title>{escape_text(str(entity["title"]))}</title>\n')
+
+        if want_template and "template" in entity:
+            write(f'    <template>{escape_text(str(entity["template"]))}</template>\n')
+
+        metadata = entity.get("metadata") if want_metadata else None
+        if metadata:
+            write("    <metadata>\n")
+            for key, value in metadata.items():
+                write(f"      <{key}>{escape_text(str(value))}</{key}>\n")
+            write("    </metadata>\n")
+
+        write("  </entity>\n")
+
+
+def _render_entity_page(entities: list[dict], requested_fields: frozenset[str]) -> str:
+    """XML fragment for one page of entities. Module-level so a process pool can run it."""
+    xml = io.StringIO()
+    _write_entities(xml.write, entities, requested_fields)
+    return xml.getvalue()
+
+
+_RENDER_WORKERS = os.cpu_count() or 1
+
+
+@lru_cache(maxsize=1)
+def _render_pool() -> ProcessPoolExecutor:
+    """Worker processes for parallel_render, started on first use and kept for later exports."""
+    return ProcessPoolExecutor(max_workers=_RENDER_WORKERS)
+
+
+def _write_entities_in_processes(write, batches: Iterator[list], requested_fields: frozenset[str]) -> None:
+    """Render pages in worker processes, writing the fragments in page order.
+
+    At most two pages per worker are in flight, so memory stays bounded while the fetch threads keep
+    the pool busy.
+    """
+    executor = _render_pool()
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append(executor.submit(_render_entity_page, batch, requested_fields))
+            if len(pending) >= 2 * _RENDER_WORKERS:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool next time instead of failing every later export
+        _render_pool.cache_clear()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
 
 
 @tool
-def get_all_entities(template_id: str, fields: str, batch_size: int = 30, language: str = "en") -> str:
+def get_all_entities(
+    template_id: str, fields: str, batch_size: int = 30, language: str = "en", parallel_render: bool = False
+) -> str:
     """
     Retrieves all entities for a given template from Uwazi instance as XML with configurable field selection.
 
@@ -100,66 +361,96 @@ def get_all_entities(template_id: str, fields: str, batch_size: int = 30, langua
                       Use "all" to include all available fields
         batch_size (int): The number of entities to retrieve per batch (default: 30).
         language (str): The language in which to retrieve the entities (default: "en").
+        parallel_render (bool): Render the XML in worker processes, one page per task (default: False).
+                                Only worth it for exports of more than about 10,000 entities.
 
     Returns:
         str: XML formatted string containing entities with requested fields.
-             Returns empty entities element on error or if no credentials.
+             Returns empty entities element if no credentials, or if Uwazi cannot be reached or
+             returns unexpected data. Any other error is raised.
     """
     try:
-        if not all([url, user, password]):
-            return '<?xml version="1.0" encoding="UTF-8"?><entities></entities>'
-
-        uwazi = UwaziAdapter(user=user, password=password, url=url)
-        entities = []
-        start_from = 0
-        while True:
-            batch = uwazi.entities.get(
-                start_from=start_from, batch_size=batch_size, template_id=template_id, language=language
-            )
-            if not batch:
-                break
-            entities.extend(batch)
-            if len(batch) < batch_size:
-                break
-            start_from += batch_size
-
-        requested_fields = (
-            [f.strip() for f in fields.split(",")]
-            if fields != "all"
-            else ["id", "sharedId", "title", "template", "metadata"]
-        )
-
-        xml_parts = ['<?xml version="1.0" encoding="UTF-8"?>', "<entities>"]
+        if not _HAS_CREDENTIALS:
+            return _EMPTY_ENTITIES
+
+        requested_fields = parse_fields(fields, ENTITY_FIELDS)
+
+        def render(uwazi) -> str:
+            # Each page is written out as soon as it arrives and then dropped, so only a few pages of
+            # entity dicts are held at a time. A fresh buffer per attempt keeps a retried read clean.
+            xml = io.StringIO()
+            write = xml.write
+            write(_ENTITIES_OPEN)
+            batches = iter_entity_batches(uwazi, template_id, batch_size, language)
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                stats = {"pages": 0, "entities": 0, "fetch": 0.0}
+                batches = _counted_batches(batches, stats)
+                start = time.perf_counter()
+            if parallel_render:
+                _write_entities_in_processes(write, batches, requested_fields)
+            else:
+                _write_entities(write, chain.from_iterable(batches), requested_fields)
+            write("</entities>")
+            if debug:
+                total = time.perf_counter() - start
+                logger.debug(
+                    "get_all_entities: %d entities in %d pages took %.3fs (%.3fs waiting for pages, %.3fs rendering)",
+                    stats["entities"],
+                    stats["pages"],
+                    total,
+                    stats["fetch"],
+                    total - stats["fetch"],
+                )
+            return xml.getvalue()
+
+        return _read_from_uwazi(render)
+    except _UWAZI_ERRORS as e:
+        logger.warning("get_all_entities failed for template %s: %s", template_id, e)
+        return _EMPTY_ENTITIES
+
+
+@_timed
+def _create_template(name: str, properties: list[dict], color: str, language: str) -> dict:
+    try:
+        if not _HAS_CREDENTIALS:
+            return {"error": "Missing required environment variables (UWAZI_URL, UWAZI_USER, UWAZI_PASSWORD)"}
 
-        for entity in entities:
-            xml_parts.append("  <entity>")
+        uwazi = _uwazi()
 
-            if "id" in requested_fields and "_id" in entity:
-                xml_parts.append(f'    <id>{entity.get("_id", "")}</id>')
+        cleaned_properties = []
+        for prop in properties:
+            if not isinstance(prop, dict):
+                continue
 
-            if "sharedId" in requested_fields and "sharedId" in entity:
-                xml_parts.append(f'    <sharedId>{entity.get("sharedId", "")}</sharedId>')
+            # A missing type reads as None, which is not a valid type either
+            if prop.get("type") not in VALID_PROPERTY_TYPES:
+                continue
 
-            if "title" in requested_fields and "title" in entity:
-                xml_parts.append(f'    <title>{entity.get("title", "")}</title>')
+            cleaned_prop = known_property_fields(prop)
 
-            if "template" in requested_fields and "template" in entity:
-                xml_parts.append(f'    <template>{entity.get("template", "")}</template>')
+            if "label" not in cleaned_prop:
+                cleaned_prop["label"] = ""
 
-            if "metadata" in requested_fields and "metadata" in entity:
-                metadata = entity.get("metadata", {})
-                if metadata:
-                    xml_parts.append("    <metadata>")
-                    for key, value in metadata.items():
-                        xml_parts.append(f"      <{key}>{value}</{key}>")
-                    xml_parts.append("    </metadata>")
+            cleaned_properties.append(cleaned_prop)
 
-            xml_parts.append("  </entity>")
+        template_dict = {
+            "name": name,
+            "color": color,
+            "entityViewPage": "",
+            "properties": cleaned_properties,
+            "commonProperties": default_common_properties(),
+        }
 
-        xml_parts.append("</entities>")
-        return "\n".join(xml_parts)
-    except Exception as e:
-        return '<?xml version="1.0" encoding="UTF-8"?><entities></entities>'
+        result = uwazi.templates.set(language=language, template=template_dict)
+        _templates_cache.clear()
+        _templates_xml_cache.clear()
+        return result
+    except _UWAZI_ERRORS as e:
+        # The write is not repeated, but the next call logs in afresh in case the session had expired
+        _uwazi.cache_clear()
+        logger.warning("create_template %r failed: %s", name, e)
+        return {"error": f"Error creating template: {str(e)}"}
 
 
 @tool
@@ -191,7 +482,8 @@ def create_template(name: str, properties: list[dict], color: str = "#000000", l
         language (str, optional): Language code for the template. Default: "en"
 
     Returns:
-        dict: The created template with its generated ID, or error dict if creation fails
+        dict: The created template with its generated ID, or {"error": ...} if credentials are missing,
+              Uwazi cannot be reached or it rejects the template. Any other error is raised.
 
     Example usage for AI agents:
         create_template(
@@ -204,77 +496,49 @@ def create_template(name: str, properties: list[dict], color: str = "#000000", l
             color="#4A90E2"
         )
     """
-    try:
-        if not all([url, user, password]):
-            return {"error": "Missing required environment variables (UWAZI_URL, UWAZI_USER, UWAZI_PASSWORD)"}
-
-        uwazi = UwaziAdapter(user=user, password=password, url=url)
-
-        valid_property_fields = {
-            "label",
-            "type",
-            "name",
-            "required",
-            "showInCard",
-            "filter",
-            "defaultfilter",
-            "prioritySorting",
-            "noLabel",
-            "style",
-            "generatedId",
-            "isCommonProperty",
-        }
-
-        valid_property_types = {
-            "text",
-            "markdown",
-            "numeric",
-            "date",
-            "link",
-            "select",
-            "multiselect",
-            "relationship",
-            "nested",
-            "image",
-            "media",
-            "preview",
-            "geolocation",
-        }
+    return _create_template(name=name, properties=properties, color=color, language=language)
 
-        cleaned_properties = []
-        for prop in properties:
-            if not isinstance(prop, dict):
-                continue
-
-            if "type" not in prop:
-                continue
-
-            if prop["type"] not in valid_property_types:
-                continue
 
-            cleaned_prop = {key: value for key, value in prop.items() if key in valid_property_fields}
+@tool
+def create_templates_bulk(templates: list[dict], language: str = "en") -> list[dict]:
+    """
+    Creates several templates in the Uwazi instance in one call.
 
-            if "label" not in cleaned_prop:
-                cleaned_prop["label"] = ""
+    Use this instead of calling create_template repeatedly whenever more than one template
+    has to be created: the templates are sent to Uwazi concurrently and the results come
+    back together, so the whole batch costs a single step.
 
-            cleaned_properties.append(cleaned_prop)
+    Args:
+        templates (list[dict]): One dict per template, with the same keys as create_template's arguments:
+            - name (str, required): The name of the template to create
+            - properties (list[dict], required): Property dictionaries, as described in create_template
+            - color (str, optional): Hex color code for the template. Default: "#000000"
+        language (str, optional): Language code for the templates. Default: "en"
 
-        template_dict = {
-            "name": name,
-            "color": color,
-            "entityViewPage": "",
-            "properties": cleaned_properties,
-            "commonProperties": [
-                {"label": "Title", "name": "title", "type": "text", "isCommonProperty": True},
-                {"label": "Date added", "name": "creationDate", "type": "date", "isCommonProperty": True},
-                {"label": "Date modified", "name": "editDate", "type": "date", "isCommonProperty": True},
-            ],
-        }
+    Returns:
+        list[dict]: The created template, or {"error": ...} if that one failed, for each entry,
+                    in the same order as `templates`
+    """
+    if not templates:
+        return []
+
+    def create(spec: dict) -> dict:
+        if not isinstance(spec, dict) or "name" not in spec:
+            return {"error": "Template spec must be a dict with at least a 'name' key"}
+        # One bad spec must not discard the results of the templates already created alongside it
+        try:
+            return _create_template(
+                name=spec["name"],
+                properties=spec.get("properties", []),
+                color=spec.get("color", "#000000"),
+                language=language,
+            )
+        except Exception as e:
+            logger.exception("create_templates_bulk: template %r failed", spec["name"])
+            return {"error": f"Error creating template: {str(e)}"}
 
-        result = uwazi.templates.set(language=language, template=template_dict)
-        return result
-    except Exception as e:
-        return {"error": f"Error creating template: {str(e)}"}
+    with ThreadPoolExecutor(max_workers=min(_BULK_CREATE_WORKERS, len(templates))) as executor:
+        return list(executor.map(create, templates))
 
 
 if __name__ == "__main__":